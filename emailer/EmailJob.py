@@ -1,3 +1,6 @@
+from email.headerregistry import Address
+
+
 def config_sender_converter(config):
     """Function to fetch the default sender configuration from the app configuration."""
     return {
@@ -31,9 +34,23 @@ class Sender:
         The sender's email address.
     display_name : str
         The display name of the sender.
+    rate_per_sec : float
+        The maximum number of emails per second to send through this sender's SMTP account.
+    max_concurrency : int
+        The maximum number of simultaneous SMTP connections to this sender's SMTP account.
     """
 
-    def __init__(self, email_server, email_port, username, password, use_tls, email_address, display_name=None):
+    # Serialized field names, in constructor order; each is stored in the slot of the same name with a leading underscore
+    _FIELDS = (
+        "email_server", "email_port", "username", "password", "use_tls", "email_address", "display_name",
+        "rate_per_sec", "max_concurrency",
+    )
+    __slots__ = tuple("_" + field for field in _FIELDS) + ("_fixed_from",)
+
+    def __init__(
+        self, email_server, email_port, username, password, use_tls, email_address, display_name=None,
+        rate_per_sec=None, max_concurrency=None,
+    ):
         """
         Initializes a new Sender instance with the given SMTP and sender details.
 
@@ -53,6 +70,12 @@ class Sender:
             The sender's email address.
         display_name : str, optional
             The display name of the sender. Defaults to None.
+        rate_per_sec : float, optional
+            The maximum send rate in emails per second. Defaults to None, which uses the
+            ``MAIL_RATE_PER_SEC`` config key of the EmailSender, or no limit.
+        max_concurrency : int, optional
+            The maximum number of simultaneous SMTP connections. Defaults to None, which uses
+            the ``MAIL_MAX_CONCURRENCY`` config key of the EmailSender, or no limit.
         """
         self._email_server = email_server
         self._email_port = email_port
@@ -61,6 +84,9 @@ class Sender:
         self._use_tls = use_tls
         self._email_address = email_address
         self._display_name = display_name
+        self._rate_per_sec = rate_per_sec
+        self._max_concurrency = max_concurrency
+        self._fixed_from = None  # Parsed 'From' header, filled in lazily by EmailSender
 
     def to_dict(self):
         """
@@ -71,15 +97,8 @@ class Sender:
         dict
             A dictionary containing the sender information.
         """
-        return {
-            "email_server": self._email_server,
-            "email_port": self._email_port,
-            "username": self._username,
-            "password": self._password,  # Note: Be careful with storing passwords!
-            "use_tls": self._use_tls,
-            "email_address": self._email_address,
-            "display_name": self._display_name,
-        }
+        # Note: this includes the password, be careful with storing it!
+        return {field: getattr(self, slot) for field, slot in zip(self._FIELDS, self.__slots__)}
 
     def get_sender_address(self):
         """
@@ -92,9 +111,14 @@ class Sender:
             otherwise just the email address.
         """
         if self._display_name:
-            from email.header import Header
-            encoded_display_name = str(Header(self._display_name, 'utf-8'))
-            return f"{encoded_display_name} <{self._email_address}>"
+            username, at, domain = self._email_address.rpartition("@")
+            if not at:
+                username, domain = self._email_address, ""
+            try:
+                # Quotes display names containing special characters, e.g. "Doe, John"
+                return str(Address(display_name=self._display_name, username=username, domain=domain))
+            except ValueError:
+                return f"{self._display_name} <{self._email_address}>"
         return self._email_address
 
     @classmethod
@@ -112,15 +136,7 @@ class Sender:
         Sender
             An instance of the Sender class.
         """
-        return cls(
-            email_server=data.get("email_server"),
-            email_port=data.get("email_port"),
-            username=data.get("username"),
-            password=data.get("password"),  # Make sure passwords are handled securely!
-            use_tls=data.get("use_tls"),
-            email_address=data.get("email_address"),
-            display_name=data.get("display_name"),
-        )
+        return cls(*map(data.get, cls._FIELDS))
 
 
 class EmailJob:
@@ -141,6 +157,10 @@ class EmailJob:
         An instance of the Sender class containing the sender's information. Defaults to None.
     """
 
+    # Serialized field names, in constructor order; each is stored in the slot of the same name with a leading underscore
+    _FIELDS = ("subject", "recipients", "body", "html", "sender", "extra_headers")
+    __slots__ = tuple("_" + field for field in _FIELDS)
+
     def __init__(self, subject, recipients, body=None, html=None, sender=None, extra_headers=None):
         """
         Initializes an EmailJob instance with the provided details.
@@ -157,6 +177,8 @@ class EmailJob:
             The HTML content of the email. Defaults to None.
         sender : Sender, optional
             An instance of the Sender class. Defaults to None.
+        extra_headers : dict, optional
+            Additional headers to include in the email. Defaults to None.
         """
         self._subject = subject
         self._recipients = recipients
@@ -174,14 +196,9 @@ class EmailJob:
         dict
             A dictionary representation of the EmailJob instance.
         """
-        return {
-            "subject": self._subject,
-            "recipients": self._recipients,
-            "body": self._body,
-            "html": self._html,
-            "sender": self._sender.to_dict() if self._sender else None,
-            "extra_headers": self._extra_headers,
-        }
+        data = {field: getattr(self, slot) for field, slot in zip(self._FIELDS, self.__slots__)}
+        data["sender"] = self._sender.to_dict() if self._sender else None
+        return data
 
     @classmethod
     def from_dict(cls, data):
@@ -198,13 +215,7 @@ class EmailJob:
         EmailJob
             An instance of the EmailJob class.
         """
-        sender_data = data.get("sender")
-        sender = Sender.from_dict(sender_data) if sender_data else None
-        return cls(
-            subject=data.get("subject"),
-            recipients=data.get("recipients"),
-            body=data.get("body"),
-            html=data.get("html"),
-            sender=sender,
-            extra_headers=data.get("extra_headers"),
-        )
+        values = dict(zip(cls._FIELDS, map(data.get, cls._FIELDS)))
+        if values["sender"]:
+            values["sender"] = Sender.from_dict(values["sender"])
+        return cls(**values)
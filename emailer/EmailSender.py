@@ -1,44 +1,362 @@
+import atexit
+import functools
+import os
+import re
 import threading
-import smtplib
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import smtplib
+import socket
+import uuid
+import weakref
 import logging
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.utils import formataddr
-from email.header import Header
-from jinja2 import Environment, FileSystemLoader
+import multiprocessing
+import mimetypes
+import posixpath
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email import policy
+from email.headerregistry import Address
+from email.message import EmailMessage
+from html.parser import HTMLParser
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateError, TemplateNotFound
+from pymongo.errors import PyMongoError
 from DatabaseManager import DatabaseManager
 from .EmailJob import EmailJob, Sender
+from .SmtpConnectionPool import (
+    SmtpConnectionPool, DEFAULT_DNS_CACHE_TTL, DEFAULT_IDLE_TTL, DEFAULT_MAX_MESSAGES_PER_CONNECTION,
+)
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
-def fix_from_header(from_address):
+# Maximum number of jobs claimed from the queue in a single round-trip
+QUEUE_BATCH_SIZE = 100
+
+# Seconds a claimed job stays invisible to other claims before it is retried
+QUEUE_LEASE_SECONDS = 300
+
+# Share of the lease a rate limited SMTP account may be booked for; jobs beyond it are put back
+LEASE_SEND_SHARE = 0.5
+
+# Sends attempted for a job before it is moved to the failed jobs
+MAX_SEND_ATTEMPTS = 4
+
+# Sends failed because the SMTP server was unreachable before a job is moved to the failed jobs
+MAX_ACCOUNT_FAILURES = 24
+
+# Seconds before the first retry of a transient failure; doubled for every further attempt
+RETRY_BACKOFF_SECONDS = 300
+RETRY_BACKOFF_MAX_SECONDS = 3600
+
+# Maximum number of sent jobs deleted from the queue in a single round-trip
+DELETE_BATCH_SIZE = 20
+
+# Default number of threads rendering and inserting queued emails
+DEFAULT_RENDER_WORKERS = 4
+
+# Default number of SMTP connections the worker sends over in parallel
+DEFAULT_POOL_SIZE = 4
+
+# A batch is only spread over another connection to the same account for every this many jobs
+MIN_JOBS_PER_CONNECTION = 10
+
+# Number of rendered (template, context) combinations kept in memory
+RENDER_CACHE_SIZE = 256
+
+# Context value types that cannot change after rendering, so a render can be reused
+_IMMUTABLE_CONTEXT_TYPES = (str, int, float, bool, bytes, type(None))
+
+# Seconds the remaining jobs of an aborted group stay invisible, because too many sends failed
+ABORTED_BATCH_BACKOFF = 5
+
+# Connection groups with fewer jobs than this are sent in full, however many fail
+ABORT_MIN_GROUP_SIZE = 5
+
+# Seconds to back off after the queue database could not be reached
+DB_ERROR_BACKOFF = 5
+
+# Config keys of the default sender, in Sender constructor order
+DEFAULT_SENDER_CONFIG_KEYS = (
+    "MAIL_SERVER", "MAIL_PORT", "MAIL_USERNAME", "MAIL_PASSWORD", "MAIL_USE_TLS", "MAIL_DEFAULT_SENDER",
+)
+
+# Serialization policy: CRLF line endings and RFC 2047 encoded headers. Bodies are kept 7-bit
+# (quoted-printable or base64) so that servers without 8BITMIME accept them
+MESSAGE_POLICY = policy.SMTP.clone(cte_type="7bit")
+
+# Serialization policy for messages with non-ASCII addresses, sent with SMTPUTF8
+MESSAGE_UTF8_POLICY = MESSAGE_POLICY.clone(utf8=True)
+
+# Seconds between queue polls without change streams; doubled on every empty poll up to the maximum
+POLL_INTERVAL_MIN = 0.05
+POLL_INTERVAL_MAX = 5
+
+# Seconds before opening a change stream is tried again after it failed
+CHANGE_STREAM_RETRY_SECONDS = 60
+
+
+def needs_smtputf8(sender, recipients):
     """
-    Fixes the encoding of the 'From' header to ensure it is properly formatted.
-    
+    Tells whether an email has a non-ASCII address and must be sent with SMTPUTF8.
+
     Parameters
     ----------
-    from_address : str
-        The email address that needs to be fixed.
-    
+    sender : Sender
+        The sender the email is sent as.
+    recipients : list of str
+        The recipient addresses.
+
+    Returns
+    -------
+    bool
+        True if the envelope sender, the 'From' address or a recipient is not ASCII.
+    """
+    from_header = from_header_for(sender._display_name, sender._email_address)
+    from_addresses = [address.addr_spec for address in from_header.addresses]
+    try:
+        # str.isascii() needs Python 3.7
+        "".join([sender._username or "", *from_addresses, *recipients]).encode("ascii")
+    except UnicodeEncodeError:
+        return True
+    return False
+
+
+@functools.lru_cache(maxsize=256)
+def from_header_for(display_name, email_address):
+    """
+    Builds the 'From' header for a sender's display name and address.
+
+    The header is built from an `email.headerregistry.Address`, so display names with special
+    characters are quoted and non-ASCII names are RFC 2047 encoded when the message is
+    serialized. The address is split at its last "@" rather than parsed, so non-ASCII addresses
+    are kept for SMTPUTF8. Results are cached, since emails are sent from a small, fixed set of
+    addresses.
+
+    Parameters
+    ----------
+    display_name : str or None
+        The display name of the sender.
+    email_address : str
+        The sender's email address. Without a display name, "Display Name <address>" is accepted too.
+
+    Returns
+    -------
+    email.headerregistry.AddressHeader
+        The parsed 'From' header.
+    """
+    if not display_name:
+        return MESSAGE_POLICY.header_factory("From", email_address)
+    username, at, domain = email_address.rpartition("@")
+    if not at:
+        username, domain = email_address, ""
+    try:
+        address = Address(display_name=display_name, username=username, domain=domain)
+    except ValueError:
+        # Line breaks in the name or address; leave the value for the SMTP server to judge
+        return MESSAGE_POLICY.header_factory("From", f"{display_name} <{email_address}>")
+    return MESSAGE_POLICY.header_factory("From", address)
+
+
+def is_account_failure(error):
+    """
+    Tells whether sending an email failed because of the SMTP server or account, not the email.
+
+    Connection errors, disconnects, refused greetings and temporary (4xx) authentication
+    failures say nothing about the email itself, so they are not counted against its
+    ``MAX_SEND_ATTEMPTS`` but against the higher ``MAX_ACCOUNT_FAILURES``. Rejected
+    credentials (5xx) are counted as attempts, so a job whose sender cannot log in is
+    eventually given up on.
+
+    Parameters
+    ----------
+    error : Exception
+        The error the send failed with.
+
+    Returns
+    -------
+    bool
+        True if the SMTP server could not be reached or refused the account.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError)):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return not 500 <= error.smtp_code < 600
+    # SMTPException subclasses OSError; any other OSError is a network error
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_permanent_failure(error):
+    """
+    Tells whether sending an email failed for a reason retrying will not fix.
+
+    SMTP 5xx replies, servers lacking a required extension such as SMTPUTF8, and emails that
+    cannot be built or have no sender are permanent. 4xx replies (e.g. greylisting) are
+    transient, and so are account failures (see `is_account_failure`) and rejected
+    credentials, since they concern the SMTP account rather than the email.
+
+    Parameters
+    ----------
+    error : Exception
+        The error the send failed with.
+
+    Returns
+    -------
+    bool
+        True if the email should not be retried.
+    """
+    if is_account_failure(error) or isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, (ValueError, smtplib.SMTPNotSupportedError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+def is_server_failure(error):
+    """
+    Tells whether sending an email failed in a way that suggests the SMTP server is unusable.
+
+    Account failures (see `is_account_failure`) and temporary SMTP errors such as 4xx replies
+    count; permanent rejections of a single email do not.
+
+    Parameters
+    ----------
+    error : Exception
+        The error the send failed with.
+
+    Returns
+    -------
+    bool
+        True if the failure should count towards aborting a batch.
+    """
+    if is_account_failure(error):
+        return True
+    return isinstance(error, smtplib.SMTPException) and not is_permanent_failure(error)
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Collects the readable text of an HTML document, one line per block element.
+    """
+
+    _BLOCK_TAGS = {
+        "address", "blockquote", "br", "div", "dl", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6",
+        "hr", "li", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+    }
+    _SKIPPED_TAGS = {"head", "script", "style", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in self._BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in self._BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def get_text(self):
+        lines = (re.sub(r"[ \t\r\f\v]+", " ", line).strip() for line in "".join(self._parts).split("\n"))
+        return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+@functools.lru_cache(maxsize=128)
+def html_to_text(html):
+    """
+    Derives a plain text alternative from an HTML email body.
+
+    Parameters
+    ----------
+    html : str
+        The HTML content of the email.
+
     Returns
     -------
     str
-        The properly formatted 'From' header.
+        The text of the document with tags, scripts and styles removed.
+    """
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.get_text()
+
+
+# DatabaseManager handles shared by every EmailSender in the process, keyed by DB_URI
+_db_managers = {}
+_db_managers_lock = threading.Lock()
+
+# Queues whose indexes were already created in this process, keyed by (DB_URI, database name)
+_indexed_queues = set()
+
+# SMTP connection pools of the EmailSender instances in this process, closed at exit
+_smtp_pools = weakref.WeakSet()
+
+
+def _close_smtp_pools():
+    """
+    Sends QUIT on the idle connections of every SMTP connection pool still open at exit.
     """
-    if from_address is None:
-        return None
+    for smtp_pool in list(_smtp_pools):
+        smtp_pool.close()
 
-    # Handle the potential case where the 'From' address contains special characters or needs encoding
-    name, address = from_address.split("<")
-    address = address.replace(">", "")
-    
-    # Fix encoding if necessary
-    name = name.strip()
-    name_header = Header(name, "utf-8").encode()
 
-    return formataddr((name_header, address))
+atexit.register(_close_smtp_pools)
+
+
+def _reset_after_fork():
+    """
+    Drops the shared DatabaseManager handles and worker registry in a forked child.
+
+    MongoClient is not fork-safe, and the parent's worker threads do not exist in the child.
+    The locks are replaced too, since a thread of the parent may have held them during the fork.
+    """
+    global _db_managers_lock
+    _db_managers_lock = threading.Lock()
+    _db_managers.clear()
+    _indexed_queues.clear()
+    EmailSender._workers_lock = threading.Lock()
+    EmailSender._workers.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_db_manager(config):
+    """
+    Returns the DatabaseManager for the configured database, creating it on first use.
+
+    Parameters
+    ----------
+    config : dict
+        The configuration dictionary for the email sender.
+
+    Returns
+    -------
+    DatabaseManager
+        The shared DatabaseManager instance for ``config["DB_URI"]``.
+    """
+    key = config.get("DB_URI")
+    with _db_managers_lock:
+        db_manager = _db_managers.get(key)
+        if db_manager is None:
+            db_manager = _db_managers[key] = DatabaseManager(config).get_instance()
+        return db_manager
 
 
 class EmailSender:
@@ -47,60 +365,633 @@ class EmailSender:
     It uses SMTP to send emails and supports templated email content.
     """
 
-    def __init__(self, config):
+    # Instances running a queue worker in this process, keyed by (DB_URI, database name)
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(self, config, db=None, start_worker=True):
         """
         Initializes the EmailSender instance with the Flask app configuration.
 
         Parameters
         ----------
-        config : dict
-            The configuration dictionary for the email sender.
+        config : dict or collections.abc.Mapping
+            The configuration dictionary for the email sender. Other mappings, such as a Flask
+            ``Config``, are copied to a plain dict once.
+        db : pymongo.database.Database, optional
+            An existing database handle to keep the email queue in. Defaults to the database of
+            a DatabaseManager shared by all EmailSender instances using the same ``DB_URI``.
+        start_worker : bool, optional
+            Whether to start the queue worker thread. Pass False in processes that only queue
+            emails, e.g. when sending is left to `start_worker_processes`. Defaults to True.
         """
-        self._config = config
-        print(config)
-        self._db_manager = DatabaseManager(config).get_instance()
-        self._db = self._db_manager.get_db()
+        # Read every config object (e.g. Flask's Config) as a plain dict
+        self._config = config if type(config) is dict else dict(config)
+        if db is None:
+            db = _get_db_manager(self._config).get_db()
+        self._db = db
         self._queue_collection = self._db["email_queue"]
-        self._env = Environment(loader=FileSystemLoader("templates/emails"))
+        self._failed_collection = self._db["email_failed"]
+        self._worker_key = (self._config.get("DB_URI"), self._db.name)
+        if self._worker_key not in _indexed_queues:
+            self._queue_collection.create_index([("created_at", 1), ("visible_at", 1)])
+            self._queue_collection.create_index([("visible_at", 1)])
+            _indexed_queues.add(self._worker_key)
+        self._env = Environment(
+            loader=FileSystemLoader("templates/emails"),
+            auto_reload=False,
+            cache_size=400,
+            bytecode_cache=FileSystemBytecodeCache(self._config.get("MAIL_TEMPLATE_CACHE_DIR")),
+        )
+        self._template_cache = {}  # template name -> compiled jinja2.Template
+        self._text_templates = {}  # HTML template name -> name of its .txt sibling, or None
+        if self._config.get("MAIL_PRECOMPILE_TEMPLATES"):
+            self.precompile_templates()
+        self._render_cache = OrderedDict()  # (template names, context items) -> (body, html)
+        self._render_cache_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._config.get("MAIL_RENDER_WORKERS", DEFAULT_RENDER_WORKERS),
+            thread_name_prefix="emailer-render",
+        )
+        self._pool_size = self._config.get("MAIL_POOL_SIZE", DEFAULT_POOL_SIZE)
+        self._send_executor = ThreadPoolExecutor(
+            max_workers=self._pool_size,
+            thread_name_prefix="emailer-send",
+        )
+        self._smtp_pool = SmtpConnectionPool(
+            idle_ttl=self._config.get("MAIL_CONNECTION_IDLE_TTL", DEFAULT_IDLE_TTL),
+            max_messages=self._config.get("MAIL_MAX_MESSAGES_PER_CONNECTION", DEFAULT_MAX_MESSAGES_PER_CONNECTION),
+            default_rate_per_sec=self._config.get("MAIL_RATE_PER_SEC"),
+            default_max_concurrency=self._config.get("MAIL_MAX_CONCURRENCY"),
+            dns_cache_ttl=self._config.get("MAIL_DNS_CACHE_TTL", DEFAULT_DNS_CACHE_TTL),
+            processes=self._config.get("MAIL_SENDING_PROCESSES", 1),
+        )
+        self._change_stream = None
+        self._change_stream_retry_at = 0  # time.monotonic() from which a change stream may be opened
+        self._change_stream_stale = False
+        self._resume_token = None
+        self._queue_empty_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()  # set by _enqueue to end a poll interval early
+        self._poll_interval = POLL_INTERVAL_MIN
+        self._busy_until = {}  # SmtpConnectionPool.key -> time the groups sent to it should be done
+        self._worker_thread = None
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        _smtp_pools.add(self._smtp_pool)
         
         if self._config.get("MAIL_DEFAULT_SENDER"):
             logger.info("Using default sender information from configuration.")
-            self.default_sender = Sender(
-                self._config.get('MAIL_SERVER'),
-                self._config.get('MAIL_PORT'),
-                self._config.get('MAIL_USERNAME'),
-                self._config.get('MAIL_PASSWORD'),
-                self._config.get('MAIL_USE_TLS'),
-                self._config.get('MAIL_DEFAULT_SENDER')
-            )
+            self.default_sender = Sender(*map(self._config.get, DEFAULT_SENDER_CONFIG_KEYS))
         else:
             logger.warning("No default sender information found in configuration.")
             self.default_sender = None
 
-        self.start_worker()
+        if start_worker:
+            self.start_worker()
 
     def start_worker(self):
         """
         Starts a background thread to process the email queue.
+
+        Only one worker runs per database and process. If another EmailSender already runs one
+        for the same database, this instance shares its queue state instead of starting a
+        second thread polling the same collection.
+
+        Returns
+        -------
+        bool
+            True if a worker thread was started, False if one was already running.
+        """
+        with EmailSender._workers_lock:
+            worker = EmailSender._workers.get(self._worker_key)
+            if worker is not None:
+                logger.info("Email queue worker already running for this database, not starting another.")
+                self._queue_empty_event = worker._queue_empty_event
+                self._wake_event = worker._wake_event
+                return False
+
+            logger.info("Starting email queue worker thread.")
+            self._stop_event.clear()
+            self._worker_thread = threading.Thread(target=self._run_worker, name="emailer-worker")
+            self._worker_thread.daemon = True
+            EmailSender._workers[self._worker_key] = self
+            self._worker_thread.start()
+            return True
+
+    def stop(self, timeout=None):
         """
-        logger.info("Starting email queue worker thread.")
-        worker_thread = threading.Thread(target=self.process_queue)
-        worker_thread.daemon = True
-        worker_thread.start()
+        Stops the worker thread started by `start_worker` and releases the instance's resources.
+
+        The batches being sent when this is called are finished first, and emails passed to
+        `queue_email` are still inserted into the queue. The render and send threads are then
+        shut down and the idle SMTP connections closed, so the instance cannot queue or send
+        emails afterwards.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait for the worker. Defaults to waiting forever.
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._worker_thread is not None:
+            self._worker_thread.join(timeout)
+            self._worker_thread = None
+        with EmailSender._workers_lock:
+            if EmailSender._workers.get(self._worker_key) is self:
+                del EmailSender._workers[self._worker_key]
+        if self._change_stream is not None:
+            self._change_stream.close()
+            self._change_stream = None
+        self._executor.shutdown()
+        self._send_executor.shutdown()
+        self._smtp_pool.close()
+        _smtp_pools.discard(self._smtp_pool)
+
+    def _run_worker(self):
+        """
+        Runs `process_queue` on the worker thread, unregistering the worker when it exits.
+        """
+        try:
+            self.process_queue()
+        finally:
+            # Let a later EmailSender start a new worker, even if this one died
+            with EmailSender._workers_lock:
+                if EmailSender._workers.get(self._worker_key) is self:
+                    del EmailSender._workers[self._worker_key]
 
     def process_queue(self):
         """
-        Continuously processes email jobs from the queue and sends them.
+        Continuously processes email jobs from the queue and sends them, until `stop` is called.
+
+        Jobs are leased in FIFO batches of up to ``QUEUE_BATCH_SIZE``. Batches are handed to the
+        send executor without waiting for them, so a slow or throttled SMTP account does not
+        hold up the others; new batches are only claimed while fewer than ``MAIL_POOL_SIZE``
+        groups are being sent. When the queue is empty the worker waits for the next insert
+        instead of polling at a fixed interval. Database errors are logged and retried after
+        ``DB_ERROR_BACKOFF`` seconds; jobs leased at the time are sent again once their lease
+        expires. Groups still being sent when the worker stops are finished first.
+        """
+        in_flight = set()
+        try:
+            while not self._stop_event.is_set():
+                in_flight = {future for future in in_flight if not future.done()}
+                if len(in_flight) >= self._pool_size:
+                    wait(in_flight, return_when=FIRST_COMPLETED)
+                    continue
+                try:
+                    claimed_jobs = self._claim_batch()
+                    if not claimed_jobs:
+                        logger.debug("No email job found in queue.")
+                        if not in_flight and not self._accounts_busy():
+                            self._queue_empty_event.set()
+                        self._wait_for_jobs()
+                        continue
+
+                    self._queue_empty_event.clear()
+                    self._change_stream_stale = True
+                    logger.info("Processing %d email jobs from queue.", len(claimed_jobs))
+                    in_flight.update(self._send_batch(claimed_jobs))
+                except PyMongoError as e:
+                    logger.error("Email queue database error, retrying in %d seconds: %s", DB_ERROR_BACKOFF, e)
+                    self._stop_event.wait(DB_ERROR_BACKOFF)
+        finally:
+            wait(in_flight)
+
+    def wait_until_empty(self, timeout=None):
+        """
+        Blocks until the worker has found the email queue empty.
+
+        Emails passed to `queue_email` before this call are waited for, even while they are
+        still being rendered.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait. Defaults to waiting forever.
+
+        Returns
+        -------
+        bool
+            True if the queue was drained, False if the timeout expired first.
+        """
+        return self._queue_empty_event.wait(timeout)
+
+    def _enqueue(self, email_jobs):
+        """
+        Inserts email jobs into the queue, immediately visible to the worker.
+
+        Parameters
+        ----------
+        email_jobs : list of EmailJob
+            The email jobs to queue.
+        """
+        now = datetime.now(timezone.utc)
+        self._queue_collection.insert_many(
+            [
+                dict(email_job.to_dict(), status="pending", created_at=now, visible_at=now)
+                for email_job in email_jobs
+            ]
+        )
+        self._queue_empty_event.clear()
+        self._wake_event.set()
+
+    def _claim_batch(self):
+        """
+        Leases up to ``QUEUE_BATCH_SIZE`` of the oldest visible jobs in the queue.
+
+        Leased jobs stay in the queue but are hidden from other claims for
+        ``QUEUE_LEASE_SECONDS``. A job is only deleted once it has been sent, so a job whose
+        worker crashes or fails to send it becomes visible again when its lease expires.
+        While leased, a job has the status ``"processing"`` and records the host and process
+        id of its worker in ``worker_id``.
+
+        Returns
+        -------
+        list of tuple
+            ``(job_id, EmailJob)`` pairs in FIFO order, empty if no job is visible.
+        """
+        now = datetime.now(timezone.utc)
+        visible = {"$or": [{"visible_at": {"$lte": now}}, {"visible_at": {"$exists": False}}]}
+        candidates = self._queue_collection.find(visible, {"_id": 1}).sort("created_at", 1).limit(QUEUE_BATCH_SIZE)
+        job_ids = [doc["_id"] for doc in candidates]
+        if not job_ids:
+            return []
+
+        # Tag the lease so that only the jobs this call actually won are read back
+        lease = uuid.uuid4().hex
+        self._queue_collection.update_many(
+            {"_id": {"$in": job_ids}, **visible},
+            {"$set": {
+                "visible_at": now + timedelta(seconds=QUEUE_LEASE_SECONDS),
+                "lease": lease,
+                "status": "processing",
+                "worker_id": self._worker_id,
+            }},
+        )
+        # Filter on the candidate ids too, so that the read-back uses the _id index
+        documents = self._queue_collection.find({"_id": {"$in": job_ids}, "lease": lease}).sort("created_at", 1)
+        return [(doc["_id"], EmailJob.from_dict(doc)) for doc in documents]
+
+    def _send_batch(self, claimed_jobs):
+        """
+        Starts sending a batch of leased email jobs, one SMTP connection per thread.
+
+        Jobs are grouped by SMTP account. Each group is split over one connection per
+        ``MIN_JOBS_PER_CONNECTION`` jobs, up to the account's ``max_concurrency`` or else the
+        ``MAIL_POOL_SIZE``. The resulting groups are sent in parallel on the send executor,
+        each as consecutive transactions over one session. See `_send_group`.
+
+        A rate limited account only keeps as many jobs as it can send within
+        ``LEASE_SEND_SHARE`` of the lease, counting the jobs it is still sending, so no job's
+        lease expires while it waits for its turn. The other jobs are put back in the queue
+        until the account is expected to be done.
+
+        Parameters
+        ----------
+        claimed_jobs : list of tuple
+            ``(job_id, EmailJob)`` pairs returned by `_claim_batch`.
+
+        Returns
+        -------
+        list of concurrent.futures.Future
+            One future per group, resolving to False if the group was aborted.
+        """
+        groups = {}
+        for job_id, email_job in claimed_jobs:
+            sender = email_job._sender or self.default_sender
+            key = self._smtp_pool.key(sender) if sender else None
+            groups.setdefault(key, (sender, []))[1].append((job_id, email_job))
+
+        futures = []
+        for key, (sender, group) in groups.items():
+            connections = 1
+            if sender is not None:
+                group = self._book_account(key, sender, group)
+                limit = self._smtp_pool.max_concurrency(sender) or self._pool_size
+                connections = max(1, min(limit, len(group) // MIN_JOBS_PER_CONNECTION))
+            for offset in range(connections):
+                future = self._send_executor.submit(self._send_group, group[offset::connections])
+                future.add_done_callback(self._group_done)
+                futures.append(future)
+        return futures
+
+    def _book_account(self, key, sender, group):
+        """
+        Books the jobs a rate limited SMTP account can send within its share of the lease.
+
+        Parameters
+        ----------
+        key : tuple
+            The `SmtpConnectionPool.key` of the account.
+        sender : Sender
+            The sender the jobs are sent as.
+        group : list of tuple
+            ``(job_id, EmailJob)`` pairs leased for the account, in FIFO order.
+
+        Returns
+        -------
+        list of tuple
+            The pairs to send now. The others are made visible again once the account is done.
+        """
+        rate = self._smtp_pool.rate_per_sec(sender)
+        if not rate:
+            return group
+        now = datetime.now(timezone.utc)
+        busy_until = max(self._busy_until.get(key, now), now)
+        capacity = int((QUEUE_LEASE_SECONDS * LEASE_SEND_SHARE - (busy_until - now).total_seconds()) * rate)
+        if busy_until == now:
+            capacity = max(capacity, 1)  # An idle account always sends something, however slow
+        kept, deferred = group[:max(capacity, 0)], group[max(capacity, 0):]
+        busy_until += timedelta(seconds=len(kept) / rate)
+        self._busy_until[key] = busy_until
+        if deferred:
+            logger.info(
+                "SMTP account %s:%s is rate limited, putting %d jobs back until %s.",
+                key[0], key[1], len(deferred), busy_until,
+            )
+            self._queue_collection.update_many(
+                {"_id": {"$in": [job_id for job_id, _ in deferred]}},
+                {"$set": {"visible_at": busy_until, "status": "pending"}},
+            )
+        return kept
+
+    def _accounts_busy(self):
+        """
+        Tells whether a rate limited SMTP account is still booked by `_book_account`.
+
+        Returns
+        -------
+        bool
+            True if jobs put back for an account are not visible yet.
         """
-        while True:
-            email_job_data = self._queue_collection.find_one_and_delete({})
-            if email_job_data:
-                logger.info("Processing email job from queue.")
-                email_job = EmailJob.from_dict(email_job_data)
-                self.send_email(email_job)
+        now = datetime.now(timezone.utc)
+        for key, busy_until in list(self._busy_until.items()):
+            if busy_until > now:
+                return True
+            del self._busy_until[key]
+        return False
+
+    def _group_done(self, future):
+        """
+        Logs a group that failed outside of its sends and wakes the worker, see `_send_batch`.
+
+        Parameters
+        ----------
+        future : concurrent.futures.Future
+            The finished future of a `_send_group` call.
+        """
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Sending an email group failed: %s", future.exception())
+        self._wake_event.set()
+
+    def _send_group(self, claimed_jobs):
+        """
+        Sends leased email jobs sharing one SMTP connection, aborting once the server failed more than a third of them.
+
+        Only failures that point at the server count towards the abort (see `is_server_failure`),
+        and groups smaller than ``ABORT_MIN_GROUP_SIZE`` are never aborted, so a few rejected
+        recipients do not hold up the worker.
+
+        Sent jobs are deleted from the queue in batches of ``DELETE_BATCH_SIZE``, and when the
+        group is done. Failed jobs are retried later or given up on, see `_handle_failure`, and
+        jobs not attempted because of an abort are released after ``ABORTED_BATCH_BACKOFF``
+        seconds.
+
+        Parameters
+        ----------
+        claimed_jobs : list of tuple
+            ``(job_id, EmailJob)`` pairs that use the same SMTP connection.
+
+        Returns
+        -------
+        bool
+            False if the group was aborted, True otherwise.
+        """
+        # Serialize every message before the first connection is checked out, so the connection
+        # is only held for the SMTP round-trips
+        messages = []
+        for _, email_job in claimed_jobs:
+            sender = email_job._sender or self.default_sender
+            try:
+                messages.append(self._build_message(email_job, sender) if sender else None)
+            except Exception:
+                messages.append(None)  # _send_one builds it again and reports the error
+
+        sessions = {}
+        sent_ids = []
+        failures = 0
+        try:
+            for index, (job_id, email_job) in enumerate(claimed_jobs):
+                try:
+                    self._send_one(email_job, sessions, messages[index])
+                except Exception as e:
+                    logger.error("Failed to send email to %s: %s", email_job._recipients, e)
+                    self._handle_failure(job_id, e)
+                    # Emails the server rejected permanently say nothing about the server's health
+                    if not is_server_failure(e):
+                        continue
+                else:
+                    sent_ids.append(job_id)
+                    if len(sent_ids) >= DELETE_BATCH_SIZE:
+                        self._delete_sent(sent_ids)
+                    continue
+                failures += 1
+                if len(claimed_jobs) >= ABORT_MIN_GROUP_SIZE and failures > len(claimed_jobs) / 3:
+                    remaining = [job_id for job_id, _ in claimed_jobs[index + 1:]]
+                    logger.error(
+                        "Aborting email batch after %d of %d sends failed; releasing %d jobs in %d seconds.",
+                        failures, index + 1, len(remaining), ABORTED_BATCH_BACKOFF,
+                    )
+                    if remaining:
+                        retry_at = datetime.now(timezone.utc) + timedelta(seconds=ABORTED_BATCH_BACKOFF)
+                        self._queue_collection.update_many(
+                            {"_id": {"$in": remaining}},
+                            {"$set": {"visible_at": retry_at, "status": "pending"}},
+                        )
+                    return False
+            return True
+        finally:
+            self._release_sessions(sessions)
+            self._delete_sent(sent_ids)
+
+    def _handle_failure(self, job_id, error):
+        """
+        Schedules a retry of a job that could not be sent, or moves it to the failed jobs.
+
+        Permanent failures (see `is_permanent_failure`) and jobs that failed
+        ``MAX_SEND_ATTEMPTS`` times are moved to the ``email_failed`` collection. Other jobs
+        become visible again after a backoff that starts at ``RETRY_BACKOFF_SECONDS`` and
+        doubles with every attempt, up to ``RETRY_BACKOFF_MAX_SECONDS``. Account failures (see
+        `is_account_failure`) are retried after ``RETRY_BACKOFF_SECONDS`` and counted
+        separately, up to ``MAX_ACCOUNT_FAILURES``, so an SMTP outage does not use up the
+        attempts of every queued email.
+
+        Parameters
+        ----------
+        job_id : bson.ObjectId
+            The id of the leased job.
+        error : Exception
+            The error the send failed with.
+        """
+        try:
+            job = self._queue_collection.find_one({"_id": job_id}, {"attempts": 1, "account_failures": 1})
+            if job is None:
+                return
+            attempts = job.get("attempts", 0)
+            account_failures = job.get("account_failures", 0)
+            if is_account_failure(error):
+                account_failures += 1
+                backoff = RETRY_BACKOFF_SECONDS
+                give_up = account_failures >= MAX_ACCOUNT_FAILURES
             else:
-                logger.debug("No email job found in queue.")
-            time.sleep(5)  # Sleep for 5 seconds before checking the queue again
+                attempts += 1
+                backoff = min(RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), RETRY_BACKOFF_MAX_SECONDS)
+                give_up = attempts >= MAX_SEND_ATTEMPTS or is_permanent_failure(error)
+            if not give_up:
+                self._queue_collection.update_one(
+                    {"_id": job_id},
+                    {"$set": {
+                        "attempts": attempts,
+                        "account_failures": account_failures,
+                        "last_error": str(error),
+                        "status": "pending",
+                        "visible_at": datetime.now(timezone.utc) + timedelta(seconds=backoff),
+                    }},
+                )
+                logger.info(
+                    "Retrying email job %s in %d seconds (attempt %d, %d account failures).",
+                    job_id, backoff, attempts, account_failures,
+                )
+                return
+
+            job = self._queue_collection.find_one_and_delete({"_id": job_id})
+            if job is not None:
+                job.update(
+                    attempts=attempts, account_failures=account_failures, last_error=str(error),
+                    status="failed", failed_at=datetime.now(timezone.utc),
+                )
+                self._failed_collection.insert_one(job)
+                logger.warning(
+                    "Giving up on email job %s after %d attempts and %d account failures: %s",
+                    job_id, attempts, account_failures, error,
+                )
+        except PyMongoError as e:
+            # The lease expires and the job is retried anyway
+            logger.error("Could not reschedule failed email job %s: %s", job_id, e)
+
+    def _delete_sent(self, sent_ids):
+        """
+        Deletes sent jobs from the queue in a single round-trip.
+
+        Parameters
+        ----------
+        sent_ids : list
+            The ids of the sent jobs. Cleared once they are deleted.
+        """
+        if sent_ids:
+            self._queue_collection.delete_many({"_id": {"$in": sent_ids}})
+            sent_ids.clear()
+
+    def _release_sessions(self, sessions):
+        """
+        Returns every connection used by `_send_one` to the SMTP pool.
+
+        Parameters
+        ----------
+        sessions : dict
+            SMTP connections keyed by `SmtpConnectionPool.key`.
+        """
+        for key, server in sessions.items():
+            self._smtp_pool.release(key, server)
+        sessions.clear()
+
+    def _wait_for_jobs(self):
+        """
+        Blocks until a job is inserted into the queue or becomes visible, or for a poll interval.
+
+        A MongoDB change stream is used to wake up on inserts, and the wait ends when the
+        earliest leased or retried job becomes visible again. Deployments without change
+        stream support (e.g. a standalone server) fall back to polling, backing off from
+        ``POLL_INTERVAL_MIN`` to ``POLL_INTERVAL_MAX`` seconds while the queue stays empty, and
+        try to open a change stream again every ``CHANGE_STREAM_RETRY_SECONDS``. Jobs queued by
+        this process and finished sends end the wait immediately.
+
+        The stream is only a wake-up signal: jobs are always claimed from the collection, so the
+        backlog left by a restart is drained by the first claim and no event has to be replayed.
+        """
+        if self._change_stream_stale:
+            # Inserts already drained by the last claims are still buffered as events; start over
+            # instead of waking up once for each of them
+            if self._change_stream is not None:
+                self._change_stream.close()
+                self._change_stream = None
+            self._resume_token = None
+            self._change_stream_stale = False
+            self._poll_interval = POLL_INTERVAL_MIN
+
+        if self._change_stream is None and time.monotonic() >= self._change_stream_retry_at:
+            try:
+                self._change_stream = self._open_change_stream()
+            except PyMongoError as e:
+                logger.info(
+                    "Change streams unavailable (%s), polling the email queue for %d seconds.",
+                    e, CHANGE_STREAM_RETRY_SECONDS,
+                )
+                self._change_stream_retry_at = time.monotonic() + CHANGE_STREAM_RETRY_SECONDS
+
+        if self._change_stream is not None:
+            try:
+                self._wait_for_change()
+                return
+            except PyMongoError as e:
+                logger.warning("Email queue change stream failed: %s", e)
+                self._resume_token = self._change_stream.resume_token
+                self._change_stream.close()
+                self._change_stream = None
+
+        self._wake_event.wait(self._poll_interval)
+        self._wake_event.clear()
+        self._poll_interval = min(self._poll_interval * 2, POLL_INTERVAL_MAX)
+
+    def _wait_for_change(self):
+        """
+        Waits on the change stream until an insert, the next visible job, a wake-up or `stop`.
+
+        Raises
+        ------
+        pymongo.errors.PyMongoError
+            If the change stream or the queue could not be read.
+        """
+        next_job = self._queue_collection.find_one({}, {"visible_at": 1}, sort=[("visible_at", 1)])
+        visible_at = next_job.get("visible_at") if next_job else None
+        if visible_at is not None and visible_at.tzinfo is None:
+            visible_at = visible_at.replace(tzinfo=timezone.utc)  # PyMongo decodes naive UTC datetimes
+        while not self._stop_event.is_set() and not self._wake_event.is_set():
+            if self._change_stream.try_next() is not None:
+                return
+            if visible_at is not None and visible_at <= datetime.now(timezone.utc):
+                return
+        self._wake_event.clear()
+
+    def _open_change_stream(self):
+        """
+        Opens a change stream on queue inserts, resuming after the last event seen if possible.
+
+        Returns
+        -------
+        pymongo.change_stream.CollectionChangeStream
+            The opened change stream.
+        """
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        if self._resume_token is not None:
+            try:
+                return self._queue_collection.watch(pipeline, max_await_time_ms=1000, resume_after=self._resume_token)
+            except PyMongoError as e:
+                logger.info("Could not resume the email queue change stream (%s), starting a new one.", e)
+            finally:
+                self._resume_token = None
+        return self._queue_collection.watch(pipeline, max_await_time_ms=1000)
 
     def send_email(self, email_job, send=True):
         """
@@ -112,70 +1003,336 @@ class EmailSender:
             The EmailJob instance containing the email details.
         send : bool, optional
             If False, the email will not be sent. Defaults to True.
+
+        Returns
+        -------
+        bool
+            True if the email was handed to the SMTP server, False otherwise.
             
         See Also
         --------
         RFC 822 section 6.1: https://datatracker.ietf.org/doc/html/rfc822.html#section-6.1
             This explains what kind of value can be used for the "From" field in an email.
         """
+        sessions = {}
         try:
-            # Determine SMTP settings and sender information
-            sender = email_job._sender 
-            if sender is None:
-                sender = self.default_sender
-                
-                if sender is None:
-                    logger.error("No sender information provided. Fallback to default sender failed.")
-                    return
-
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = email_job._subject
-            
-            # Fix the 'From' header before assigning it
-            fixed_from = fix_from_header(sender.get_sender_address())
-            msg["From"] = fixed_from
-            print(msg["From"])  # For debugging purposes
-            
-            msg["To"] = ", ".join(email_job._recipients)
-            
-            # Add extra headers if provided, e.g., Reply-To
-            if email_job._extra_headers:
-                for key, value in email_job._extra_headers.items():
-                    msg[key] = value
+            self._send_one(email_job, sessions)
+            return True
+        except Exception as e:
+            logger.error("Failed to send email: %s", e)
+            return False
+        finally:
+            self._release_sessions(sessions)
+
+    def _send_one(self, email_job, sessions, msg_bytes=None):
+        """
+        Sends an email job, continuing an SMTP session already used for the same connection.
+
+        The first message for a connection acquires it from the pool. Later messages on it
+        are separated with RSET instead of reconnecting; servers that treat RSET as QUIT are
+        reconnected.
+
+        Parameters
+        ----------
+        email_job : EmailJob
+            The EmailJob instance containing the email details.
+        sessions : dict
+            SMTP connections checked out by the caller, keyed by `SmtpConnectionPool.key`. Updated in place;
+            the caller hands them back with `_release_sessions`.
+        msg_bytes : bytes, optional
+            The message already built with `_build_message`. Built here if not given.
+
+        Raises
+        ------
+        ValueError
+            If the job has no sender and there is no default sender.
+        smtplib.SMTPException or OSError
+            If the SMTP server could not be reached or did not accept the email.
+        """
+        # Determine SMTP settings and sender information
+        sender = email_job._sender or self.default_sender
+        if sender is None:
+            raise ValueError("No sender information provided. Fallback to default sender failed.")
 
-            # Attach the body (plain or HTML)
+        if msg_bytes is None:
+            msg_bytes = self._build_message(email_job, sender)
+
+        key = self._smtp_pool.key(sender)
+        server = sessions.get(key)
+        if server is None:
+            server = sessions[key] = self._smtp_pool.acquire(sender)
+        else:
+            try:
+                server.rset()
+            except smtplib.SMTPServerDisconnected:
+                logger.debug("SMTP server %s:%s closed the session on RSET, reconnecting.", key[0], key[1])
+                del sessions[key]
+                self._smtp_pool.discard(key, server)
+                server = sessions[key] = self._smtp_pool.acquire(sender)
+
+        self._smtp_pool.throttle(sender)
+
+        try:
+            self._transmit(server, sender, email_job._recipients, msg_bytes)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped a connection that looked alive; nothing was accepted, so
+            # re-send once over a new connection
+            logger.debug("SMTP server %s:%s disconnected mid-session, re-sending.", key[0], key[1])
+            del sessions[key]
+            self._smtp_pool.discard(key, server)
+            server = sessions[key] = self._smtp_pool.acquire(sender)
+            try:
+                self._transmit(server, sender, email_job._recipients, msg_bytes)
+            except OSError as e:
+                if is_account_failure(e):
+                    del sessions[key]
+                    self._smtp_pool.discard(key, server)
+                raise
+        except OSError as e:
+            # Never hand a broken connection back to the pool. SMTP replies rejecting this email
+            # (SMTPException subclasses OSError) leave the session usable for the next one
+            if is_account_failure(e):
+                del sessions[key]
+                self._smtp_pool.discard(key, server)
+            raise
+
+        if self._smtp_pool.record_message(server):
+            # Reconnect before the server's per-connection message limit is reached
+            del sessions[key]
+            self._smtp_pool.discard(key, server)
+
+        logger.debug("Email sent to %s", email_job._recipients)
+        self._dump_message(msg_bytes)
+
+    def _build_message(self, email_job, sender):
+        """
+        Builds the MIME message for an email job and serializes it for SMTP.
+
+        Parameters
+        ----------
+        email_job : EmailJob
+            The EmailJob instance containing the email details.
+        sender : Sender
+            The sender the email is sent as.
+
+        Returns
+        -------
+        bytes
+            The CRLF-terminated message, ready to be passed to ``sendmail``.
+        """
+        # Non-ASCII addresses cannot be RFC 2047 encoded; they are sent as UTF-8 with SMTPUTF8
+        msg_policy = MESSAGE_UTF8_POLICY if needs_smtputf8(sender, email_job._recipients) else MESSAGE_POLICY
+        msg = EmailMessage(policy=msg_policy)
+        msg["Subject"] = email_job._subject
+
+        # Build the 'From' header once per Sender instance; the policy encodes non-ASCII names
+        from_header = sender._fixed_from
+        if from_header is None:
+            from_header = sender._fixed_from = from_header_for(sender._display_name, sender._email_address)
+        msg["From"] = from_header
+
+        msg["To"] = ", ".join(email_job._recipients)
+
+        # Add extra headers if provided, e.g., Reply-To
+        if email_job._extra_headers:
+            for key, value in email_job._extra_headers.items():
+                msg[key] = value
+
+        # Only an email with both a text and an HTML body needs a multipart/alternative wrapper
+        if email_job._html:
             if email_job._body:
-                msg.attach(MIMEText(email_job._body, "plain"))
-                
-            if email_job._html:
-                msg.attach(MIMEText(email_job._html, "html"))
-
-            # Send the email using SMTP
-            with smtplib.SMTP(sender._email_server, sender._email_port) as server:
-                if sender._use_tls:
-                    server.starttls()
-                server.login(sender._username, sender._password)
-                
-                # Convert message to string
-                msg_string = msg.as_string(unixfrom=False)
-                
-                # Optionally write the email to a file for debugging
-                with open("email.txt", "w") as f:
-                    f.write(msg_string)
-
-                # Send the email
-                server.sendmail(sender._username, email_job._recipients, msg_string)
-            
-            logger.debug(f"Email sent to {email_job._recipients}")
+                msg.set_content(email_job._body)
+                msg.add_alternative(email_job._html, subtype="html")
+            else:
+                msg.set_content(email_job._html, subtype="html")
+        else:
+            msg.set_content(email_job._body or "")
 
-        except Exception as e:
-            logger.error(f"Failed to send email: {str(e)}")
-            # Optionally, requeue the email or log the error
+        # The policy serializes straight to CRLF-terminated bytes, which smtplib transmits as is
+        return msg.as_bytes()
+
+    def _dump_message(self, msg_bytes):
+        """
+        Writes a sent message to its own file for debugging, if enabled.
+
+        Messages are only written when DEBUG logging is enabled and the ``MAIL_DUMP_MESSAGES``
+        config key names the directory to write them to.
+
+        Parameters
+        ----------
+        msg_bytes : bytes
+            The message returned by `_build_message`.
+        """
+        dump_dir = self._config.get("MAIL_DUMP_MESSAGES")
+        if not dump_dir or not logger.isEnabledFor(logging.DEBUG):
+            return
+        path = os.path.join(dump_dir, f"{uuid.uuid4().hex}.eml")
+        try:
+            with open(path, "wb") as f:
+                f.write(msg_bytes)
+        except OSError as e:
+            logger.warning("Could not write outgoing message to %s: %s", path, e)
+            return
+        logger.debug("Wrote outgoing message to %s", path)
+
+    def _transmit(self, server, sender, recipients, msg_bytes):
+        """
+        Sends a serialized message over an SMTP connection checked out from the pool.
+
+        Parameters
+        ----------
+        server : smtplib.SMTP
+            The connection checked out from the pool for the sender.
+        sender : Sender
+            The sender the email is sent as.
+        recipients : list of str
+            The envelope recipients.
+        msg_bytes : bytes
+            The message returned by `_build_message`.
+
+        Notes
+        -----
+        The bytes are passed to ``sendmail`` rather than the message to ``send_message``, which
+        would serialize it again. Like ``send_message``, SMTPUTF8 is requested when an address
+        is not ASCII; `_build_message` then writes the headers as UTF-8 to match.
+        """
+        mail_options = ()
+        if needs_smtputf8(sender, recipients):
+            mail_options = ("SMTPUTF8", "BODY=8BITMIME")
+        refused = server.sendmail(sender._username, recipients, msg_bytes, mail_options)
+        if refused:
+            logger.warning("SMTP server refused some recipients, sent to the others: %s", refused)
+
+    def precompile_templates(self):
+        """
+        Compiles every email template up front, so the first emails sent don't pay for it.
+
+        Templates that fail to compile are logged and skipped; they raise again when used.
+
+        Returns
+        -------
+        int
+            The number of templates compiled.
+        """
+        compiled = 0
+        for template_name in self._env.list_templates():
+            try:
+                self._get_template(template_name)
+                compiled += 1
+            except TemplateError as e:
+                logger.warning("Could not precompile email template %s: %s", template_name, e)
+        logger.debug("Precompiled %d email templates.", compiled)
+        return compiled
+
+    def _get_template(self, template_name):
+        """
+        Returns the compiled template with the given name, loading it only on first use.
+
+        Parameters
+        ----------
+        template_name : str
+            The name of the email template file.
+
+        Returns
+        -------
+        jinja2.Template
+            The compiled template.
+        """
+        template = self._template_cache.get(template_name)
+        if template is None:
+            template = self._template_cache.setdefault(template_name, self._env.get_template(template_name))
+        return template
+
+    def _text_template_for(self, template_name):
+        """
+        Returns the plain text template sharing an HTML template's name, e.g. ``welcome.txt`` for ``welcome.html``.
+
+        Parameters
+        ----------
+        template_name : str
+            The name of the HTML email template file.
+
+        Returns
+        -------
+        str or None
+            The name of the plain text template, or None if there is none.
+        """
+        try:
+            return self._text_templates[template_name]
+        except KeyError:
+            pass
+        text_template_name = posixpath.splitext(template_name)[0] + ".txt"
+        try:
+            self._get_template(text_template_name)
+        except TemplateNotFound:
+            text_template_name = None
+        self._text_templates[template_name] = text_template_name
+        return text_template_name
+
+    def _render(self, template_name, context, text_template_name=None):
+        """
+        Renders the HTML body of an email and its plain text alternative.
+
+        Templates named ``*.txt`` are rendered as a plain text email without an HTML part. For an
+        HTML template, the plain text part comes from ``text_template_name``, else from a ``.txt``
+        template next to it with the same name, else it is derived from the HTML.
 
-    def queue_email(self, template_name, subject, recipients, context, sender=None, extra_headers=None, send=True):
+        Renders are cached per template and context when every context value is an immutable
+        scalar, so sending the same email to many recipients renders it only once.
+
+        Parameters
+        ----------
+        template_name : str
+            The name of the HTML email template file.
+        context : dict
+            A dictionary of context variables to render the templates.
+        text_template_name : str, optional
+            The name of a plain text template for the text part of an HTML email.
+
+        Returns
+        -------
+        tuple of str
+            The plain text body, and the HTML body or None.
+        """
+        key = None
+        if all(isinstance(value, _IMMUTABLE_CONTEXT_TYPES) for value in context.values()):
+            # Values of different types can compare equal (True == 1 == 1.0) but render differently
+            key = (template_name, text_template_name, frozenset((k, type(v), v) for k, v in context.items()))
+            with self._render_cache_lock:
+                rendered = self._render_cache.get(key)
+                if rendered is not None:
+                    self._render_cache.move_to_end(key)
+                    return rendered
+
+        if mimetypes.guess_type(template_name)[0] == "text/plain":
+            body = self._get_template(template_name).render(context)
+            html = None
+        else:
+            html = self._get_template(template_name).render(context)
+            text_template_name = text_template_name or self._text_template_for(template_name)
+            if text_template_name:
+                body = self._get_template(text_template_name).render(context)
+            else:
+                body = html_to_text(html)
+        rendered = (body, html)
+
+        if key is not None:
+            with self._render_cache_lock:
+                self._render_cache[key] = rendered
+                if len(self._render_cache) > RENDER_CACHE_SIZE:
+                    self._render_cache.popitem(last=False)
+        return rendered
+
+    def queue_email(
+        self, template_name, subject, recipients, context, sender=None, extra_headers=None, send=True,
+        text_template_name=None,
+    ):
         """
         Queues an email for sending using the provided template and context.
 
+        Rendering the template and inserting the job into the queue happen on a background
+        thread, so this returns immediately. The context must not be modified afterwards.
+
         Parameters
         ----------
         template_name : str
@@ -192,19 +1349,53 @@ class EmailSender:
             Additional headers to include in the email. Defaults to None.
         send : bool, optional
             If False, the email will not be sent. Defaults to True.
+        text_template_name : str, optional
+            The name of a plain text template for the text part. Defaults to text derived from
+            the rendered HTML.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            A future that completes once the email has been queued.
         """
-        template = self._env.get_template(template_name)
-        body = template.render(context)
-        email_job = EmailJob(
-            subject=subject, recipients=recipients, body=body, html=body, sender=sender, extra_headers=extra_headers
-        )
         if send:
-            self._queue_collection.insert_one(email_job.to_dict())
-            logger.debug(f"Queued email to {recipients} with subject '{subject}'")
-        else:
-            logger.debug(f"Dry run: Email to {recipients} with subject '{subject}' not queued")
+            # Let wait_until_empty wait for this email from now on, not only once it is inserted
+            self._queue_empty_event.clear()
+        return self._executor.submit(
+            self._render_and_insert,
+            template_name, subject, recipients, context, sender, extra_headers, send, text_template_name,
+        )
 
-    def send_now(self, template_name, subject, recipients, context, sender=None, extra_headers=None, send=True):
+    def _render_and_insert(
+        self, template_name, subject, recipients, context, sender, extra_headers, send, text_template_name
+    ):
+        """
+        Renders an email template and inserts the resulting job into the queue.
+
+        See `queue_email` for the parameters.
+        """
+        try:
+            body, html = self._render(template_name, context, text_template_name)
+            email_job = EmailJob(
+                subject=subject, recipients=recipients, body=body, html=html, sender=sender,
+                extra_headers=extra_headers,
+            )
+            if send:
+                self._enqueue([email_job])
+                logger.debug("Queued email to %s with subject '%s'", recipients, subject)
+            else:
+                logger.debug("Dry run: Email to %s with subject '%s' not queued", recipients, subject)
+        except Exception:
+            logger.exception("Failed to queue email with template '%s'", template_name)
+            if send:
+                # Nothing was inserted; let the worker find the queue empty again
+                self._wake_event.set()
+            raise
+
+    def send_now(
+        self, template_name, subject, recipients, context, sender=None, extra_headers=None, send=True,
+        text_template_name=None,
+    ):
         """
         Sends an email immediately using the provided template and context.
 
@@ -224,14 +1415,70 @@ class EmailSender:
             Additional headers to include in the email. Defaults to None.
         send : bool, optional
             If False, the email will not be sent. Defaults to True.
+        text_template_name : str, optional
+            The name of a plain text template for the text part. Defaults to text derived from
+            the rendered HTML.
         """
-        template = self._env.get_template(template_name)
-        body = template.render(context)
+        body, html = self._render(template_name, context, text_template_name)
         email_job = EmailJob(
-            subject=subject, recipients=recipients, body=body, html=body, sender=sender, extra_headers=extra_headers
+            subject=subject, recipients=recipients, body=body, html=html, sender=sender,
+            extra_headers=extra_headers,
         )
         if send:
             self.send_email(email_job)
-            logger.debug(f"Sent email to {recipients} with subject '{subject}'")
+            logger.debug("Sent email to %s with subject '%s'", recipients, subject)
         else:
-            logger.debug(f"Dry run: Email to {recipients} with subject '{subject}' not sent")
+            logger.debug("Dry run: Email to %s with subject '%s' not sent", recipients, subject)
+
+
+def _run_worker_process(config):
+    """
+    Entry point of a worker process started by `start_worker_processes`.
+
+    Parameters
+    ----------
+    config : dict
+        The configuration dictionary for the email sender.
+    """
+    EmailSender(config, start_worker=False).process_queue()
+
+
+def start_worker_processes(config, processes=None):
+    """
+    Starts processes that each send emails from the queue, to scale beyond one interpreter.
+
+    Every process runs its own EmailSender with its own database client and SMTP connection
+    pool. Jobs are leased when they are claimed, so the processes never send the same job.
+    EmailSender instances in the calling process should be created with ``start_worker=False``.
+
+    Rate and connection limits are enforced per process, so each process gets an equal share
+    of them through ``MAIL_SENDING_PROCESSES``. Every process keeps at least one connection per
+    SMTP account, so ``max_concurrency`` is exceeded when it is lower than ``processes``.
+
+    Parameters
+    ----------
+    config : dict
+        The configuration dictionary for the email sender. It must be picklable.
+    processes : int, optional
+        The number of processes to start. Defaults to the ``MAIL_WORKER_PROCESSES`` config key,
+        or the number of CPUs.
+
+    Returns
+    -------
+    list of multiprocessing.Process
+        The started daemon processes.
+    """
+    processes = processes or config.get("MAIL_WORKER_PROCESSES") or os.cpu_count() or 1
+    # MongoClient is not fork-safe, so children start from a fresh interpreter
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=_run_worker_process, args=(dict(config, MAIL_SENDING_PROCESSES=processes),),
+            name=f"emailer-worker-{index}", daemon=True,
+        )
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info("Started %d email queue worker processes.", len(workers))
+    return workers
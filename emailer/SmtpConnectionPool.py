@@ -0,0 +1,479 @@
+import itertools
+import smtplib
+import socket
+import threading
+import time
+import logging
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Pooled connections idle for longer than this many seconds are checked with NOOP before reuse
+NOOP_AFTER_IDLE_SECONDS = 5
+
+# Default number of seconds an idle pooled connection is kept open
+DEFAULT_IDLE_TTL = 60
+
+# Default number of messages sent over one connection before it is replaced
+DEFAULT_MAX_MESSAGES_PER_CONNECTION = 100
+
+# Default number of seconds resolved SMTP server addresses are cached
+DEFAULT_DNS_CACHE_TTL = 300
+
+
+class _AddressCache:
+    """
+    A cache of resolved SMTP server addresses, handed out round-robin.
+
+    getaddrinfo does not report the TTL of DNS records, so entries expire after a fixed number
+    of seconds, or as soon as connecting to one of their addresses fails.
+    """
+
+    def __init__(self, ttl):
+        """
+        Parameters
+        ----------
+        ttl : float
+            Seconds a resolved address list is reused.
+        """
+        self._ttl = ttl
+        self._entries = {}  # (host, port) -> (addresses, round-robin counter, monotonic expiry time)
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """
+        Returns the addresses of a host, resolving it if it is not cached.
+
+        Each call starts the list at the next address, spreading new connections over all of them.
+
+        Parameters
+        ----------
+        host : str
+            The host name of the SMTP server.
+        port : int
+            The port of the SMTP server.
+
+        Returns
+        -------
+        list of str
+            The IP addresses of the host, in the order they should be tried.
+        """
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic():
+                entry = None
+        if entry is None:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            # Keep the resolver's preference order, without duplicates
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            entry = (addresses, itertools.count(), time.monotonic() + self._ttl)
+            with self._lock:
+                self._entries[key] = entry
+        addresses, counter, _ = entry
+        start = next(counter) % len(addresses)
+        return addresses[start:] + addresses[:start]
+
+    def invalidate(self, host, port):
+        """
+        Forgets the addresses of a host, so that it is resolved again on the next connect.
+
+        Parameters
+        ----------
+        host : str
+            The host name of the SMTP server.
+        port : int
+            The port of the SMTP server.
+        """
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+class _ResolvingSMTP(smtplib.SMTP):
+    """
+    An SMTP connection that connects to an address from an `_AddressCache`.
+
+    The host name is still used for everything else, including the TLS server name.
+    """
+
+    def __init__(self, host, port, address_cache):
+        """
+        Connects to the SMTP server.
+
+        Parameters
+        ----------
+        host : str
+            The host name of the SMTP server.
+        port : int
+            The port of the SMTP server.
+        address_cache : _AddressCache
+            The cache to resolve the host with.
+        """
+        self._address_cache = address_cache
+        super().__init__(host, port)
+
+    def _get_socket(self, host, port, timeout):
+        error = None
+        for address in self._address_cache.resolve(host, port):
+            try:
+                return socket.create_connection((address, port), timeout, self.source_address)
+            except OSError as e:
+                error = e
+        # Every address failed, the records may have changed
+        self._address_cache.invalidate(host, port)
+        raise error
+
+
+class _RateLimiter:
+    """
+    A token bucket allowing a number of acquisitions per second, shared between threads.
+
+    Callers that exceed the rate reserve the next free slot and sleep until it arrives, so
+    concurrent callers are spread out evenly instead of retrying in lockstep.
+    """
+
+    def __init__(self, rate):
+        """
+        Parameters
+        ----------
+        rate : float
+            The number of acquisitions allowed per second, which is also the burst size.
+        """
+        self._rate = rate
+        self._capacity = max(rate, 1)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until the caller may proceed without exceeding the rate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class SmtpConnectionPool:
+    """
+    A thread-safe pool of authenticated SMTP connections, keyed by SMTP account.
+
+    A connection is checked out with `acquire` and belongs to the caller until it is handed
+    back with `release`, or closed with `discard` if it broke. Idle connections are closed by a
+    background reaper thread once they have not been used for ``idle_ttl`` seconds, and
+    `record_message` tells the caller when a connection has carried ``max_messages`` messages
+    and should be replaced, before providers start rejecting it.
+
+    The pool also enforces the per-account limits of the senders using it: at most
+    ``max_concurrency`` connections checked out at once, and at most ``rate_per_sec`` messages
+    per second through `throttle`. The limits only hold within one process; when ``processes``
+    pools send with the same accounts, each pool takes an equal share of them.
+    """
+
+    def __init__(
+        self, idle_ttl=DEFAULT_IDLE_TTL, max_messages=DEFAULT_MAX_MESSAGES_PER_CONNECTION,
+        default_rate_per_sec=None, default_max_concurrency=None, dns_cache_ttl=DEFAULT_DNS_CACHE_TTL,
+        processes=1,
+    ):
+        """
+        Initializes an empty pool.
+
+        Parameters
+        ----------
+        idle_ttl : float, optional
+            Seconds an idle connection is kept open. Defaults to ``DEFAULT_IDLE_TTL``.
+        max_messages : int, optional
+            Messages sent over one connection before it is replaced. None means no limit.
+            Defaults to ``DEFAULT_MAX_MESSAGES_PER_CONNECTION``.
+        default_rate_per_sec : float, optional
+            The send rate limit for senders without ``rate_per_sec``. Defaults to no limit.
+        default_max_concurrency : int, optional
+            The connection limit for senders without ``max_concurrency``. Defaults to no limit.
+        dns_cache_ttl : float, optional
+            Seconds resolved server addresses are reused for new connections. None disables
+            the cache. Defaults to ``DEFAULT_DNS_CACHE_TTL``.
+        processes : int, optional
+            The number of processes sending with the same SMTP accounts. Rate limits are divided
+            between them, and so are connection limits, keeping at least one connection per
+            process. Defaults to 1.
+        """
+        self._idle_ttl = idle_ttl
+        self._max_messages = max_messages
+        self._default_rate_per_sec = default_rate_per_sec
+        self._default_max_concurrency = default_max_concurrency
+        self._processes = processes
+        self._idle = {}  # key -> list of (smtplib.SMTP, monotonic time it was released)
+        self._limits = {}  # key -> (rate limiter, connection slots, max connections, max rate)
+        self._message_counts = {}  # smtplib.SMTP -> messages sent over it
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._reaper = None
+        self._address_cache = _AddressCache(dns_cache_ttl) if dns_cache_ttl else None
+
+    @staticmethod
+    def key(sender):
+        """
+        Returns the key identifying the SMTP account of a sender.
+
+        Parameters
+        ----------
+        sender : Sender
+            The sender to build the key for.
+
+        Returns
+        -------
+        tuple
+            The (server, port, username, use_tls) of the sender.
+        """
+        return (sender._email_server, sender._email_port, sender._username, bool(sender._use_tls))
+
+    def acquire(self, sender):
+        """
+        Checks out an authenticated connection for the sender, reusing an idle one if possible.
+
+        Blocks while the sender's account already has ``max_concurrency`` connections checked
+        out. Connections that sat idle for more than ``NOOP_AFTER_IDLE_SECONDS`` are checked
+        with NOOP first, and replaced if the server no longer answers.
+
+        Parameters
+        ----------
+        sender : Sender
+            The sender whose SMTP server and credentials should be used.
+
+        Returns
+        -------
+        smtplib.SMTP
+            A connected and logged in SMTP connection.
+        """
+        key = self.key(sender)
+        slots = self._limits_for(sender)[1]
+        if slots is not None:
+            slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.get(key)
+                    server, released_at = idle.pop() if idle else (None, None)
+                if server is None:
+                    break
+                if time.monotonic() - released_at < NOOP_AFTER_IDLE_SECONDS:
+                    return server
+                try:
+                    code, _ = server.noop()
+                    if code == 250:
+                        return server
+                except (smtplib.SMTPException, OSError):
+                    pass
+                logger.debug("Pooled SMTP connection to %s:%s is dead, reconnecting.", key[0], key[1])
+                self._close(server)
+
+            if self._address_cache is not None:
+                try:
+                    server = _ResolvingSMTP(sender._email_server, sender._email_port, self._address_cache)
+                except smtplib.SMTPConnectError:
+                    self._address_cache.invalidate(sender._email_server, sender._email_port)
+                    raise
+            else:
+                server = smtplib.SMTP(sender._email_server, sender._email_port)
+            try:
+                if sender._use_tls:
+                    server.starttls()
+                server.login(sender._username, sender._password)
+            except Exception:
+                server.close()
+                raise
+            self._message_counts[server] = 0
+            return server
+        except Exception:
+            if slots is not None:
+                slots.release()
+            raise
+
+    def release(self, key, server):
+        """
+        Returns a connection checked out with `acquire` to the pool.
+
+        Parameters
+        ----------
+        key : tuple
+            The `key` of the sender the connection was checked out for.
+        server : smtplib.SMTP
+            The connection to return.
+        """
+        with self._lock:
+            self._idle.setdefault(key, []).append((server, time.monotonic()))
+            slots = self._limits[key][1]
+        if slots is not None:
+            slots.release()
+        self._start_reaper()
+
+    def discard(self, key, server):
+        """
+        Closes a connection checked out with `acquire` instead of returning it to the pool.
+
+        Parameters
+        ----------
+        key : tuple
+            The `key` of the sender the connection was checked out for.
+        server : smtplib.SMTP
+            The broken or unwanted connection.
+        """
+        self._close(server)
+        with self._lock:
+            slots = self._limits[key][1]
+        if slots is not None:
+            slots.release()
+
+    def record_message(self, server):
+        """
+        Counts a message sent over a checked-out connection.
+
+        Parameters
+        ----------
+        server : smtplib.SMTP
+            The connection the message was sent over.
+
+        Returns
+        -------
+        bool
+            True if the connection has reached ``max_messages`` and should be discarded.
+        """
+        count = self._message_counts.get(server, 0) + 1
+        self._message_counts[server] = count
+        return self._max_messages is not None and count >= self._max_messages
+
+    def throttle(self, sender):
+        """
+        Blocks until another message may be sent without exceeding the sender's rate limit.
+
+        Parameters
+        ----------
+        sender : Sender
+            The sender about to send a message.
+        """
+        rate_limiter = self._limits_for(sender)[0]
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+
+    def max_concurrency(self, sender):
+        """
+        Returns the maximum number of connections the sender's account may have checked out.
+
+        Parameters
+        ----------
+        sender : Sender
+            The sender to look up.
+
+        Returns
+        -------
+        int or None
+            The connection limit, or None if there is none.
+        """
+        return self._limits_for(sender)[2]
+
+    def rate_per_sec(self, sender):
+        """
+        Returns the maximum number of messages per second the sender's account may send.
+
+        Parameters
+        ----------
+        sender : Sender
+            The sender to look up.
+
+        Returns
+        -------
+        float or None
+            The rate limit, or None if there is none.
+        """
+        return self._limits_for(sender)[3]
+
+    def close(self):
+        """
+        Stops the reaper and sends QUIT on every idle connection.
+        """
+        self._closed.set()
+        with self._lock:
+            idle = [server for servers in self._idle.values() for server, _ in servers]
+            self._idle.clear()
+        for server in idle:
+            self._close(server)
+
+    def _limits_for(self, sender):
+        """
+        Returns the limits of the sender's account, creating them from the first sender seen for it.
+
+        Parameters
+        ----------
+        sender : Sender
+            The sender to look up.
+
+        Returns
+        -------
+        tuple
+            ``(rate_limiter, slots, max_concurrency, rate_per_sec)``. The rate limiter and the connection
+            slot semaphore are None when the corresponding limit is not set.
+        """
+        key = self.key(sender)
+        with self._lock:
+            limits = self._limits.get(key)
+            if limits is None:
+                rate = sender._rate_per_sec or self._default_rate_per_sec
+                concurrency = sender._max_concurrency or self._default_max_concurrency
+                if rate:
+                    rate /= self._processes
+                if concurrency:
+                    concurrency = max(1, concurrency // self._processes)
+                limits = self._limits[key] = (
+                    _RateLimiter(rate) if rate else None,
+                    threading.BoundedSemaphore(concurrency) if concurrency else None,
+                    concurrency,
+                    rate,
+                )
+        return limits
+
+    def _start_reaper(self):
+        """
+        Starts the thread closing expired idle connections, if it is not running yet.
+        """
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="emailer-smtp-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap(self):
+        """
+        Closes idle connections that were not used for ``idle_ttl`` seconds, until the pool is closed.
+        """
+        while not self._closed.wait(self._idle_ttl / 2):
+            expired = []
+            deadline = time.monotonic() - self._idle_ttl
+            with self._lock:
+                for key, idle in self._idle.items():
+                    expired.extend(server for server, released_at in idle if released_at < deadline)
+                    idle[:] = [(server, released_at) for server, released_at in idle if released_at >= deadline]
+            for server in expired:
+                self._close(server)
+            if expired:
+                logger.debug("Closed %d idle SMTP connections.", len(expired))
+
+    def _close(self, server):
+        """
+        Closes an SMTP connection, sending QUIT if the server is still listening.
+
+        Parameters
+        ----------
+        server : smtplib.SMTP
+            The connection to close.
+        """
+        self._message_counts.pop(server, None)
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
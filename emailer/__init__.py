@@ -1,4 +1,4 @@
-from emailer.EmailSender import EmailSender
+from emailer.EmailSender import EmailSender, start_worker_processes
 from emailer.EmailJob import EmailJob, Sender
 
-__all__ = ["EmailSender", "EmailJob", "Sender"]
\ No newline at end of file
+__all__ = ["EmailSender", "EmailJob", "Sender", "start_worker_processes"]
\ No newline at end of file
@@ -14,6 +14,7 @@ setup(
     include_package_data=True,  # Include non-Python files (e.g., templates)
     install_requires=[
         "Jinja2>=3.0",
+        "pymongo",
         'DatabaseManager @ git+https://github.com/botsarefuture/DatabaseManager.git@v1.2.0'
     ],
     python_requires=">=3.6",  # Python version requirement